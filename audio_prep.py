@@ -0,0 +1,241 @@
+# audio_prep.py — server-side audio preprocessing before STT
+#
+# decode -> downmix to mono -> low-pass + resample to 16 kHz -> trim leading/trailing
+# silence (energy-based VAD) -> re-encode. All sample math is vectorized NumPy;
+# WAV and raw PCM (audio/L16, audio/pcm) are decoded in-process, compressed
+# formats such as the browser's webm/opus only when an `ffmpeg` binary is on
+# PATH. Clips with no frame above the silence floor are rejected outright so
+# they never reach a paid provider. Anything we cannot decode passes through
+# untouched — preprocessing is an optimization, never a new failure mode.
+import io
+import os
+import time
+import wave
+import shutil
+import subprocess
+from typing import List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # optional: without NumPy uploads go to STT as recorded
+    np = None
+
+TARGET_RATE = 16000
+FRAME_MS = 20
+LOWPASS_TRANSITION_HZ = 1000  # anti-alias filter roll-off width before downsampling
+SILENCE_DBFS = float(os.getenv("VAD_SILENCE_DBFS", "-50"))  # frames quieter than this are never speech
+VAD_MARGIN_DB = float(os.getenv("VAD_MARGIN_DB", "10"))      # speech must clear the noise floor by this much
+VAD_PAD_MS = int(os.getenv("VAD_PAD_MS", "200"))             # keep this much audio around the speech
+MIN_SPEECH_MS = int(os.getenv("VAD_MIN_SPEECH_MS", "100"))
+FFMPEG = shutil.which("ffmpeg")
+PCM_TYPES = ("audio/l16", "audio/pcm", "audio/x-raw")
+
+class SilentAudio(ValueError):
+    """The clip contains no speech; reject it before any provider call."""
+
+class PrepStage:
+    __slots__ = ("name", "bytes_in", "bytes_out", "audio_in", "audio_out", "ms")
+
+    def __init__(self, name, bytes_in, bytes_out, audio_in, audio_out, ms):
+        self.name, self.bytes_in, self.bytes_out = name, bytes_in, bytes_out
+        self.audio_in, self.audio_out, self.ms = audio_in, audio_out, ms
+
+    def as_dict(self) -> dict:
+        return {"stage":self.name, "bytes_saved":self.bytes_in - self.bytes_out,
+                "audio_s_saved":round(self.audio_in - self.audio_out, 3), "ms":round(self.ms, 2)}
+
+class PrepReport:
+    def __init__(self, bytes_in: int):
+        self.bytes_in = bytes_in
+        self.bytes_out = bytes_in
+        self.stages: List[PrepStage] = []
+        self.skipped: Optional[str] = None  # why the input was passed through
+
+    def add(self, name, t0, bytes_in, bytes_out, audio_in, audio_out):
+        self.stages.append(PrepStage(name, bytes_in, bytes_out, audio_in, audio_out, (time.perf_counter() - t0) * 1000))
+
+    def as_dict(self) -> dict:
+        return {"bytes_in":self.bytes_in, "bytes_out":self.bytes_out, "skipped":self.skipped,
+                "stages":[s.as_dict() for s in self.stages]}
+
+def _pcm_bytes(x) -> int:
+    """Size of `x` as 16-bit PCM — the common unit for per-stage byte savings."""
+    return x.size * 2
+
+def _duration(x, rate: int) -> float:
+    return x.shape[0] / rate
+
+# ---------- Decode ----------
+def _mime(content_type: Optional[str]) -> Tuple[str, dict]:
+    base, *params = (content_type or "").lower().split(";")
+    opts = dict(p.strip().split("=", 1) for p in params if "=" in p)
+    return base.strip(), opts
+
+def can_decode(content_type: Optional[str]) -> bool:
+    base, _ = _mime(content_type)
+    if np is None:
+        return False
+    return base in ("audio/wav", "audio/x-wav", "audio/wave") or base in PCM_TYPES or FFMPEG is not None
+
+def _decode_wav(data: bytes):
+    with wave.open(io.BytesIO(data)) as w:
+        rate, channels, width = w.getframerate(), w.getnchannels(), w.getsampwidth()
+        raw = w.readframes(w.getnframes())
+    if width == 1:
+        x = (np.frombuffer(raw, np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        x = np.frombuffer(raw, "<i2").astype(np.float32) / 32768
+    elif width == 4:
+        x = np.frombuffer(raw, "<i4").astype(np.float32) / 2147483648
+    else:
+        return None
+    return x.reshape(-1, channels), rate
+
+ENDIANNESS = {"little": "<", "le": "<", "1234": "<", "s16le": "<", "big": ">", "be": ">", "4321": ">", "s16be": ">"}
+
+def _pcm_byte_order(base: str, opts: dict) -> Optional[str]:
+    """'<' or '>'; None when the parameters name a byte order we don't know."""
+    given = opts.get("endianness") or opts.get("format")
+    if given is not None:
+        return ENDIANNESS.get(given.strip('"').lower())
+    return ">" if base == "audio/l16" else "<"  # L16 is network order (RFC 2586); raw PCM is s16le
+
+def _decode_pcm(data: bytes, base: str, opts: dict):
+    order = _pcm_byte_order(base, opts)
+    if order is None:
+        return None
+    rate, channels = int(opts.get("rate", TARGET_RATE)), int(opts.get("channels", 1))
+    usable = len(data) - len(data) % (2 * channels)
+    return (np.frombuffer(data[:usable], f"{order}i2").astype(np.float32) / 32768).reshape(-1, channels), rate
+
+def _ffmpeg(args: List[str], data: bytes) -> Optional[bytes]:
+    try:
+        p = subprocess.run([FFMPEG, "-hide_banner", "-loglevel", "error", *args],
+                           input=data, capture_output=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return p.stdout if p.returncode == 0 and p.stdout else None
+
+def _decode_ffmpeg(data: bytes):
+    # ffmpeg already downmixes/resamples while decoding; cheaper than doing it twice
+    raw = _ffmpeg(["-i", "pipe:0", "-f", "s16le", "-ac", "1", "-ar", str(TARGET_RATE), "pipe:1"], data)
+    if raw is None:
+        return None
+    return (np.frombuffer(raw, "<i2").astype(np.float32) / 32768).reshape(-1, 1), TARGET_RATE
+
+def decode(data: bytes, content_type: Optional[str] = None):
+    """-> (samples float32 [frames, channels] in [-1, 1], sample rate) or None if undecodable."""
+    base, opts = _mime(content_type)
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        try:
+            return _decode_wav(data)
+        except (wave.Error, EOFError, ValueError):
+            return None
+    if base in PCM_TYPES:
+        return _decode_pcm(data, base, opts)
+    if FFMPEG:
+        return _decode_ffmpeg(data)
+    return None
+
+# ---------- Transform ----------
+def downmix(x):
+    return x if x.shape[1] == 1 else x.mean(axis=1, keepdims=True, dtype=np.float32)
+
+def lowpass_fir(rate: int, cutoff: float, transition: float = LOWPASS_TRANSITION_HZ):
+    """Blackman-windowed sinc low-pass, unity gain at DC; ~`transition` Hz wide roll-off."""
+    taps = int(5.5 * rate / transition) | 1  # odd length keeps the filter centred
+    n = np.arange(taps) - taps // 2
+    h = np.sinc(2 * cutoff / rate * n) * np.blackman(taps)
+    return (h / h.sum()).astype(np.float32)
+
+def resample(x, rate: int, target: int = TARGET_RATE):
+    if rate <= target:  # never upsample: it only adds bytes
+        return x, rate
+    # anti-alias first: nothing above the new Nyquist may fold back into the speech band
+    cutoff = target / 2 - LOWPASS_TRANSITION_HZ / 2  # stop band starts just under 8 kHz
+    y = np.convolve(x[:, 0], lowpass_fir(rate, cutoff), mode="same")
+    if rate % target == 0:  # 48k/32k -> 16k: plain decimation of the filtered signal
+        return y[::rate // target].reshape(-1, 1), target
+    n_out = int(x.shape[0] * target / rate)
+    pos = np.arange(n_out, dtype=np.float64) * (rate / target)
+    return np.interp(pos, np.arange(y.shape[0]), y).astype(np.float32).reshape(-1, 1), target
+
+def trim_silence(x, rate: int):
+    """Energy VAD over 20 ms frames; keeps first..last voiced frame plus padding."""
+    frame = rate * FRAME_MS // 1000
+    n = x.shape[0] // frame
+    if n == 0:
+        raise SilentAudio("Clip too short")
+    frames = x[:n * frame, 0].reshape(n, frame)
+    db = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-12)
+    peak = db.max()
+    if peak < SILENCE_DBFS:
+        raise SilentAudio(f"Peak level {peak:.1f} dBFS is below {SILENCE_DBFS} dBFS")
+    threshold = max(SILENCE_DBFS, min(np.percentile(db, 10) + VAD_MARGIN_DB, peak - 20))
+    voiced = np.flatnonzero(db > threshold)
+    if voiced.size * FRAME_MS < MIN_SPEECH_MS:
+        raise SilentAudio("No speech detected")
+    pad = VAD_PAD_MS // FRAME_MS
+    start = max(0, voiced[0] - pad) * frame
+    end = min(n, voiced[-1] + 1 + pad) * frame
+    return x[start:end]
+
+# ---------- Encode ----------
+def encode_wav(x, rate: int) -> bytes:
+    pcm = (np.clip(x[:, 0], -1, 1) * 32767).astype("<i2").tobytes()
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm)
+    return buf.getvalue()
+
+def encode_compressed(x, rate: int) -> Optional[bytes]:
+    pcm = (np.clip(x[:, 0], -1, 1) * 32767).astype("<i2").tobytes()
+    return _ffmpeg(["-f", "s16le", "-ar", str(rate), "-ac", "1", "-i", "pipe:0",
+                    "-c:a", "libopus", "-b:a", "24k", "-f", "ogg", "pipe:1"], pcm)
+
+# ---------- Pipeline ----------
+def preprocess(data: bytes, content_type: Optional[str] = None) -> Tuple[bytes, PrepReport]:
+    """
+    Returns (audio to send to STT, report). Raises SilentAudio for clips with no
+    speech. The original bytes are returned whenever processing would not make
+    the upload smaller.
+    """
+    report = PrepReport(len(data))
+    if np is None:
+        report.skipped = "numpy not installed"
+        return data, report
+
+    t0 = time.perf_counter()
+    decoded = decode(data, content_type)
+    if decoded is None:
+        report.skipped = "no local decoder"
+        return data, report
+    x, rate = decoded
+    audio = _duration(x, rate)
+    report.add("decode", t0, len(data), _pcm_bytes(x), audio, audio)
+
+    t0 = time.perf_counter()
+    y = downmix(x)
+    report.add("downmix", t0, _pcm_bytes(x), _pcm_bytes(y), audio, audio)
+
+    t0 = time.perf_counter()
+    x, rate = resample(y, rate)
+    report.add("resample", t0, _pcm_bytes(y), _pcm_bytes(x), audio, audio)
+
+    t0 = time.perf_counter()
+    y = trim_silence(x, rate)
+    report.add("trim", t0, _pcm_bytes(x), _pcm_bytes(y), audio, _duration(y, rate))
+
+    t0 = time.perf_counter()
+    wav_in = data[:4] == b"RIFF"
+    out = encode_wav(y, rate) if wav_in or not FFMPEG else (encode_compressed(y, rate) or encode_wav(y, rate))
+    report.add("encode", t0, _pcm_bytes(y), len(out), _duration(y, rate), _duration(y, rate))
+
+    if len(out) >= len(data):
+        report.skipped = "output not smaller than input"
+        return data, report
+    report.bytes_out = len(out)
+    return out, report
@@ -0,0 +1 @@
+# bench — offline load tests for fastapi_app.py with local provider stand-ins
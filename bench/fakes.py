@@ -0,0 +1,107 @@
+# bench/fakes.py — injectable stand-ins for AssemblyAI, Gemini and Murf
+#
+# `install(profile)` swaps the call functions in `providers` for fakes that
+# sleep for a configurable latency (+ jitter) and fail at a configurable rate.
+# The fakes still run inside the real Provider envelopes, so concurrency
+# limits, timeouts, retries and /metrics behave exactly as in production —
+# only the network round-trip is simulated.
+import random
+import asyncio
+import itertools
+
+import providers
+
+class Stage:
+    """Latency model for one provider: mean seconds, +/- uniform jitter, error probability."""
+
+    def __init__(self, latency: float, jitter: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def delay(self) -> float:
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def fails(self) -> bool:
+        return random.random() < self.error_rate
+
+class Profile:
+    def __init__(self, stt: Stage, llm: Stage, tts: Stage, upload_per_chunk: float = 0.002,
+                 first_token: float = 0.25, reply_sentences: int = 3):
+        self.stt = stt
+        self.llm = llm
+        self.tts = tts
+        self.upload_per_chunk = upload_per_chunk
+        self.first_token = first_token  # share of LLM latency before the first delta
+        self.reply_sentences = reply_sentences
+
+PROFILES = {
+    # near-zero latency: measures the server's own overhead
+    "instant": lambda: Profile(Stage(0), Stage(0), Stage(0), upload_per_chunk=0),
+    # rough production medians for a short voice turn
+    "realistic": lambda: Profile(Stage(1.2, 0.4), Stage(0.9, 0.3), Stage(0.7, 0.25)),
+    # realistic latencies with transient provider failures
+    "flaky": lambda: Profile(Stage(1.2, 0.4, 0.05), Stage(0.9, 0.3, 0.05), Stage(0.7, 0.25, 0.1)),
+    # providers under stress: long tails
+    "slow": lambda: Profile(Stage(3.0, 2.0), Stage(2.5, 1.5), Stage(1.5, 1.0)),
+}
+
+_ids = itertools.count()
+
+async def _wait(stage: Stage, name: str):
+    await asyncio.sleep(stage.delay())
+    if stage.fails():
+        raise providers.ProviderError(f"fake {name} failure", retryable=True)
+
+def install(profile: Profile):
+    """Replace the provider calls with fakes driven by `profile`."""
+
+    async def stt_upload(chunks) -> str:
+        async for _ in chunks:
+            if profile.upload_per_chunk:
+                await asyncio.sleep(profile.upload_per_chunk)
+        return f"https://fake-assemblyai.local/upload/{next(_ids)}"
+
+    async def transcribe(audio) -> str:
+        await providers.stt.call(_wait, profile.stt, "assemblyai")
+        return f"Benchmark question number {next(_ids)}, what should I do today?"
+
+    def _reply() -> str:
+        n = next(_ids)
+        return " ".join(f"This is sentence {i} of benchmark reply {n}." for i in range(profile.reply_sentences))
+
+    async def generate(prompt: str) -> str:
+        await providers.llm.call(_wait, profile.llm, "gemini")
+        return _reply()
+
+    async def _deltas(text: str):
+        words = text.split(" ")
+        await asyncio.sleep(profile.llm.delay() * profile.first_token)
+        if profile.llm.fails():
+            raise providers.ProviderError("fake gemini failure", retryable=True)
+        step = profile.llm.delay() * (1 - profile.first_token) / max(1, len(words))
+        for i, w in enumerate(words):
+            yield w if i == 0 else " " + w
+            await asyncio.sleep(step)
+
+    async def _stream_factory(text: str):
+        return _deltas(text)
+
+    async def generate_stream(prompt: str):
+        async for delta in providers.llm.stream(_stream_factory, _reply()):
+            yield delta
+
+    async def murf_generate(text: str, voice_id: str, fmt: str = "mp3") -> str:
+        await providers.tts.call(_wait, profile.tts, "murf")
+        return f"https://fake-murf.local/audio/{next(_ids)}.{fmt}"
+
+    async def download(url: str) -> bytes:
+        await asyncio.sleep(0.01)
+        return b"\xff\xfb" + b"\x00" * 4096  # a few KB of "mp3"
+
+    providers.stt_upload = stt_upload
+    providers.transcribe = transcribe
+    providers.generate = generate
+    providers.generate_stream = generate_stream
+    providers.murf_generate = murf_generate
+    providers.download = download
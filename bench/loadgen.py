@@ -0,0 +1,230 @@
+# bench/loadgen.py — offline load driver for fastapi_app.py
+#
+# Replays a recorded clip across many concurrent sessions against /agent/chat
+# (plus optional /tts traffic) and reports p50/p95/p99 latency and turns/sec of
+# completed (2xx) turns, shed and error rates, the per-stage breakdown from
+# Server-Timing, and memory growth per session.
+#
+#   python -m bench.loadgen --profile realistic --sessions 50 --turns 4
+#   python -m bench.loadgen --profile flaky --sessions 200 --concurrency 100 --json out.json
+#   python -m bench.loadgen --url http://127.0.0.1:8000 ...   # against `python -m bench.serve`
+#
+# By default the app runs in-process behind httpx's ASGI transport with the
+# fakes from bench/fakes.py installed, so no network or API keys are needed.
+import gc
+import os
+import math
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+from contextlib import nullcontext
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_AUDIO = ROOT / "uploads" / "recording.webm"
+
+def configure_env(args):
+    """Isolate the in-process app: temp history DB / TTS cache, no disk copies of fake audio."""
+    tmp = Path(tempfile.mkdtemp(prefix="voice-bench-"))
+    os.environ.setdefault("HISTORY_BACKEND", args.history)
+    os.environ.setdefault("HISTORY_DB", str(tmp / "history.db"))
+    os.environ.setdefault("TTS_CACHE_DIR", str(tmp / "tts_cache"))
+    os.environ.setdefault("TTS_CACHE_PERSIST", "0")
+    os.environ.setdefault("TTS_RETRY_BACKOFF", "0.05")
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, math.ceil(p / 100 * len(ordered)) - 1)  # nearest rank
+    return ordered[k]
+
+def parse_server_timing(header: str):
+    for part in header.split(","):
+        name, _, rest = part.strip().partition(";dur=")
+        if rest:
+            yield name.rstrip("_0123456789") if name.startswith("tts_chunk") else name, float(rest)
+
+class Recorder:
+    """Latency percentiles only cover 2xx responses; sheds (503) and errors are counted apart."""
+
+    def __init__(self):
+        self.requests = defaultdict(int)
+        self.latency = defaultdict(list)  # endpoint -> seconds, successful requests only
+        self.shed = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.status = defaultdict(lambda: defaultdict(int))
+        self.stages = defaultdict(list)  # stage -> ms
+
+    def add(self, endpoint: str, seconds: float, resp: httpx.Response | None):
+        self.requests[endpoint] += 1
+        if resp is None:
+            self.errors[endpoint] += 1
+            self.status[endpoint]["exc"] += 1
+            return
+        self.status[endpoint][resp.status_code] += 1
+        if resp.status_code == 503:
+            self.shed[endpoint] += 1
+            return
+        if not resp.is_success:
+            self.errors[endpoint] += 1
+            return
+        self.latency[endpoint].append(seconds)
+        for stage, ms in parse_server_timing(resp.headers.get("server-timing", "")):
+            self.stages[stage].append(ms)
+
+    def summary(self, endpoint: str) -> dict:
+        n, lat = self.requests[endpoint], self.latency[endpoint]
+        return {
+            "n": n,
+            "ok": len(lat),
+            "shed": self.shed[endpoint],
+            "errors": self.errors[endpoint],
+            "shed_rate": round(self.shed[endpoint] / n, 4) if n else 0.0,
+            "error_rate": round(self.errors[endpoint] / n, 4) if n else 0.0,
+            "status": {str(k): v for k, v in self.status[endpoint].items()},
+            **{f"p{p}_ms": round(percentile(lat, p) * 1000, 1) for p in (50, 95, 99)},
+            "max_ms": round(max(lat) * 1000, 1) if lat else 0.0,
+        }
+
+async def _timed(rec: Recorder, endpoint: str, request):
+    t0 = time.perf_counter()
+    try:
+        resp = await request
+    except httpx.HTTPError as e:
+        rec.add(endpoint, time.perf_counter() - t0, None)
+        print(f"{endpoint}: {type(e).__name__}: {e}", file=sys.stderr)
+        return
+    rec.add(endpoint, time.perf_counter() - t0, resp)
+
+async def chat_session(client: httpx.AsyncClient, sid: str, turns: int, audio: bytes, rec: Recorder):
+    for _ in range(turns):
+        files = {"file": ("recording.webm", audio, "audio/webm")}
+        await _timed(rec, "/agent/chat", client.post(f"/agent/chat/{sid}", files=files))
+
+async def tts_request(client: httpx.AsyncClient, text: str, rec: Recorder):
+    await _timed(rec, "/tts", client.post("/tts", json={"text": text}))
+
+async def run(args) -> dict:
+    audio = Path(args.audio).read_bytes()
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+        lifespan = nullcontext()
+    else:
+        configure_env(args)
+        sys.path.insert(0, str(ROOT))
+        from bench import fakes
+        import fastapi_app
+        fakes.install(fakes.PROFILES[args.profile]())
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=fastapi_app.app),
+                                   base_url="http://bench", timeout=args.timeout)
+        lifespan = fastapi_app.app.router.lifespan_context(fastapi_app.app)
+
+    async with lifespan, client:
+        # warm up imports, pools and the pre-rendered fallback before measuring
+        await chat_session(client, "bench-warmup", 1, audio, Recorder())
+        gc.collect()
+        rss0 = rss_bytes()
+
+        rec = Recorder()
+        gate = asyncio.Semaphore(args.concurrency)
+
+        async def limited(coro):
+            async with gate:
+                await coro
+
+        jobs = [limited(chat_session(client, f"bench-{i}", args.turns, audio, rec)) for i in range(args.sessions)]
+        distinct = args.tts_distinct or args.tts_requests or 1
+        jobs += [limited(tts_request(client, f"Benchmark phrase number {i % distinct}.", rec))
+                 for i in range(args.tts_requests)]
+        t0 = time.perf_counter()
+        await asyncio.gather(*jobs)
+        elapsed = time.perf_counter() - t0
+
+        gc.collect()
+        rss1 = rss_bytes()
+
+    turns = len(rec.latency["/agent/chat"])  # completed (2xx) turns only
+    return {
+        "mode": args.url or f"in-process/{args.profile}",
+        "sessions": args.sessions,
+        "turns_per_session": args.turns,
+        "concurrency": args.concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "turns_per_s": round(turns / elapsed, 2) if elapsed else 0.0,
+        "endpoints": {ep: rec.summary(ep) for ep in rec.requests},
+        "stages_ms": {
+            stage: {"p50": round(percentile(v, 50), 1), "p95": round(percentile(v, 95), 1), "n": len(v)}
+            for stage, v in sorted(rec.stages.items())
+        },
+        # meaningful in-process only; against --url this is the driver's own RSS
+        "rss_growth_bytes": rss1 - rss0,
+        "rss_growth_per_session_bytes": (rss1 - rss0) // max(1, args.sessions),
+    }
+
+def print_report(r: dict):
+    print(f"\n{r['mode']}: {r['sessions']} sessions x {r['turns_per_session']} turns, "
+          f"concurrency {r['concurrency']}, {r['elapsed_s']}s")
+    print(f"{'endpoint':<14}{'n':>6}{'ok':>6}{'shed':>6}{'err':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}   (ms, 2xx only)")
+    for ep, s in r["endpoints"].items():
+        print(f"{ep:<14}{s['n']:>6}{s['ok']:>6}{s['shed']:>6}{s['errors']:>6}"
+              f"{s['p50_ms']:>9}{s['p95_ms']:>9}{s['p99_ms']:>9}{s['max_ms']:>9}")
+    print(f"throughput: {r['turns_per_s']} completed turns/s")
+    if r["stages_ms"]:
+        print("stages (Server-Timing p50/p95 ms): " +
+              ", ".join(f"{k} {v['p50']}/{v['p95']}" for k, v in r["stages_ms"].items()))
+    print(f"memory: RSS {r['rss_growth_bytes'] / 2**20:+.1f} MiB total, "
+          f"{r['rss_growth_per_session_bytes'] / 1024:+.1f} KiB/session")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Offline load test for fastapi_app.py")
+    ap.add_argument("--url", help="target a running server instead of the in-process app")
+    ap.add_argument("--profile", default="realistic", help="fake provider profile: instant, realistic, flaky, slow")
+    ap.add_argument("--history", default="sqlite", choices=("sqlite", "memory"))
+    ap.add_argument("--audio", default=str(DEFAULT_AUDIO))
+    ap.add_argument("--sessions", type=int, default=20)
+    ap.add_argument("--turns", type=int, default=3)
+    ap.add_argument("--concurrency", type=int, default=20)
+    ap.add_argument("--tts-requests", type=int, default=0)
+    ap.add_argument("--tts-distinct", type=int, default=0, help="distinct /tts texts (0 = all unique)")
+    ap.add_argument("--timeout", type=float, default=120)
+    ap.add_argument("--json", help="also write the report to this file")
+    ap.add_argument("--fail-p95-ms", type=float, help="exit 1 if /agent/chat p95 exceeds this (CI gate)")
+    ap.add_argument("--fail-error-rate", type=float,
+                    help="exit 1 if more than this fraction of /agent/chat turns are shed or fail "
+                         "(default 0.01 whenever --fail-p95-ms is set)")
+    args = ap.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+    chat = report["endpoints"].get("/agent/chat", {})
+    failed = False
+    if args.fail_p95_ms and chat.get("p95_ms", 0) > args.fail_p95_ms:
+        print(f"FAIL: /agent/chat p95 {chat['p95_ms']}ms > {args.fail_p95_ms}ms")
+        failed = True
+    max_bad = args.fail_error_rate if args.fail_error_rate is not None else (0.01 if args.fail_p95_ms else None)
+    if max_bad is not None:
+        bad = chat.get("shed_rate", 0) + chat.get("error_rate", 0)
+        if bad > max_bad or not chat.get("ok"):
+            print(f"FAIL: /agent/chat shed+error rate {bad:.2%} > {max_bad:.2%} ({chat.get('ok', 0)} turns completed)")
+            failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
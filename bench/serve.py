@@ -0,0 +1,28 @@
+# bench/serve.py — run fastapi_app.py with fake providers, for `loadgen --url`
+#
+#   python -m bench.serve --profile flaky --port 8000
+import os
+import argparse
+import tempfile
+
+import uvicorn
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--profile", default="realistic")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="voice-bench-")
+    os.environ.setdefault("HISTORY_DB", os.path.join(tmp, "history.db"))
+    os.environ.setdefault("TTS_CACHE_DIR", os.path.join(tmp, "tts_cache"))
+    os.environ.setdefault("TTS_CACHE_PERSIST", "0")
+
+    from bench import fakes
+    import fastapi_app
+    fakes.install(fakes.PROFILES[args.profile]())
+    uvicorn.run(fastapi_app.app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
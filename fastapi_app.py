@@ -1,62 +1,126 @@
 # fastapi_app.py — Day 12 UI backend with Day 10 history + Day 11 robust error handling
 import os
 import re
-import requests
+import json
+import time
+import asyncio
 import traceback
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import List, Dict
+from typing import List
 
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, File, UploadFile, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from dotenv import load_dotenv
 
-import assemblyai as aai
-from google import genai  # Gemini client
+import metrics
+import audio_prep
+import providers  # async STT / LLM / TTS layer (loads .env, owns the clients)
+import scheduler
+from tts_cache import TTSCache, cache_key
+from ingest import AudioIngest, UploadLimitMiddleware, UploadTooLarge
+from history import ContextWindow, HistoryStore, MemoryHistoryStore, SQLiteHistoryStore
 
-# ---------- Config & Clients ----------
-load_dotenv()
+# ---------- App ----------
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Render canned phrases in the background so startup never waits on Murf
+    prerender = asyncio.create_task(tts_cache.prerender(CANNED_PHRASES, DEFAULT_VOICE))
+    yield
+    prerender.cancel()
+    await tts_cache.aclose()
+    await history_store.aclose()
+    await providers.aclose()
 
-MURF_API_KEY = os.getenv("MURF_API_KEY")
-ASSEMBLYAI_API_KEY = os.getenv("ASSEMBLYAI_API_KEY")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+app = FastAPI(title="My Assistant AI", lifespan=lifespan)
 
-aai.settings.api_key = ASSEMBLYAI_API_KEY
-
-gemini_client = None
-if GEMINI_API_KEY:
-    gemini_client = genai.Client(api_key=GEMINI_API_KEY)
+BASE_DIR = Path(__file__).parent
+UPLOADS = BASE_DIR / "uploads"
+UPLOADS.mkdir(exist_ok=True)
 
-app = FastAPI(title="My Assistant AI")
+MURF_MAX_CHARS = 3000
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+UPLOAD_CHUNK = 64 * 1024
+INGEST_DIR = UPLOADS / "incoming"  # spooled recordings, deleted after STT
+STT_STREAM_UPLOAD = os.getenv("STT_STREAM_UPLOAD", "1") == "1"  # forward chunks to AssemblyAI while recording
+AUDIO_PREP = os.getenv("AUDIO_PREP", "1") == "1"  # trim silence / downmix / resample before STT (/agent/chat)
+TTS_FANOUT = int(os.getenv("TTS_FANOUT", "4"))  # chunks of one reply synthesized in parallel
+TTS_CHUNK_RETRIES = int(os.getenv("TTS_CHUNK_RETRIES", "2"))
+TTS_RETRY_BACKOFF = float(os.getenv("TTS_RETRY_BACKOFF", "0.5"))
+DEFAULT_VOICE = "en-IN-rohan"
+FALLBACK_TEXT = "I'm having trouble connecting right now. Please try again in a moment."
+FALLBACK_TTS_TIMEOUT = float(os.getenv("FALLBACK_TTS_TIMEOUT", "5"))
+CANNED_PHRASES = [FALLBACK_TEXT]  # pre-rendered to disk at startup
 
+# Added innermost first: the upload limit's 413 still gets CORS + trace headers
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # tighten in production
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Request-ID"],
 )
+app.add_middleware(metrics.TraceMiddleware)  # per-request trace ID + Server-Timing header
 
-BASE_DIR = Path(__file__).parent
-UPLOADS = BASE_DIR / "uploads"
-UPLOADS.mkdir(exist_ok=True)
+# Rendered audio, keyed by (text, voice, format); disk copies are served under /audio
+TTS_CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR", UPLOADS / "tts_cache"))
+tts_cache = TTSCache(
+    TTS_CACHE_DIR,
+    url_prefix="/audio",
+    max_entries=int(os.getenv("TTS_CACHE_ENTRIES", "1000")),
+    ttl=float(os.getenv("TTS_CACHE_TTL", "3600")),  # Murf's audio URLs are short-lived
+    persist=os.getenv("TTS_CACHE_PERSIST", "1") == "1",
+    max_files=int(os.getenv("TTS_CACHE_MAX_FILES", "1000")),
+)
+app.mount("/audio", StaticFiles(directory=TTS_CACHE_DIR), name="audio")
 
-MURF_MAX_CHARS = 3000
-FALLBACK_TEXT = "I'm having trouble connecting right now. Please try again in a moment."
+# Scheduling: at most MAX_ACTIVE_TURNS turns hit the providers at once and at most
+# MAX_QUEUED_TURNS wait (up to QUEUE_TIMEOUT s) behind them; anything beyond is shed
+# with a fast 503 + Retry-After. Turns of one session run one at a time, in order.
+admission = scheduler.AdmissionControl(
+    max_active=int(os.getenv("MAX_ACTIVE_TURNS", "16")),
+    max_queued=int(os.getenv("MAX_QUEUED_TURNS", "32")),
+    queue_timeout=float(os.getenv("QUEUE_TIMEOUT", "10")),
+)
+# Streaming recordings spool to disk and upload to AssemblyAI while the user talks;
+# they get their own cap so speech time never holds a turn slot.
+recordings = scheduler.OpenLimit(int(os.getenv("MAX_OPEN_RECORDINGS", "64")), "recordings")
+session_locks = scheduler.SessionLocks(max_pending=int(os.getenv("MAX_SESSION_PENDING", "2")))
+tts_flight = scheduler.SingleFlight()  # identical in-flight TTS chunks share one Murf call
 
-# Day 10: simple in-memory history
-# { session_id: [{"role":"user","content":"..."}, {"role":"assistant","content":"..."}] }
-history_store: Dict[str, List[Dict[str, str]]] = {}
-MAX_HISTORY = 12
+# Day 10: chat history — SQLite (WAL, shared by all workers) or in-memory for dev.
+# Only a bounded LRU of hot sessions is kept in memory; the prompt gets the newest
+# messages that fit PROMPT_HISTORY_CHARS (~4 chars per token).
+HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "sqlite")
+PROMPT_HISTORY_CHARS = int(os.getenv("PROMPT_HISTORY_CHARS", "8000"))
+HISTORY_API_LIMIT = 100
+_history_opts = dict(
+    budget=PROMPT_HISTORY_CHARS,
+    max_sessions=int(os.getenv("HISTORY_HOT_SESSIONS", "1000")),
+    idle_ttl=float(os.getenv("HISTORY_IDLE_TTL", "900")),
+)
+history_store: HistoryStore
+if HISTORY_BACKEND == "memory":
+    history_store = MemoryHistoryStore(**_history_opts)
+else:
+    history_store = SQLiteHistoryStore(
+        os.getenv("HISTORY_DB", str(BASE_DIR / "chat_history.db")),
+        **_history_opts,
+    )
 
 # ---------- Models ----------
 class TextIn(BaseModel):
     text: str
 
 # ---------- Helpers ----------
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
 def chunk_text(text: str, limit: int = MURF_MAX_CHARS) -> List[str]:
-    sentences = re.split(r'(?<=[.!?])\s+', text.strip())
+    sentences = SENTENCE_END.split(text.strip())
     chunks, cur = [], ""
     for s in sentences:
         if not s:
@@ -78,38 +142,135 @@ def chunk_text(text: str, limit: int = MURF_MAX_CHARS) -> List[str]:
         chunks.append(cur)
     return chunks
 
-def murf_tts(text: str, voice_id: str = "en-IN-rohan") -> List[str]:
-    if not MURF_API_KEY:
-        raise RuntimeError("MURF_API_KEY not configured")
-    api = "https://api.murf.ai/v1/speech/generate"
-    headers = {"accept":"application/json","content-type":"application/json","api-key":MURF_API_KEY}
-    urls = []
-    for chunk in chunk_text(text):
-        r = requests.post(api, json={"voiceId":voice_id,"text":chunk,"format":"mp3"}, headers=headers, timeout=60)
-        if r.status_code != 200:
-            raise RuntimeError(f"Murf error {r.status_code}: {r.text}")
-        url = r.json().get("audioFile")
-        if not url:
-            raise RuntimeError("Murf returned no audioFile")
-        urls.append(url)
-    return urls
+class SentenceStream:
+    """Streaming chunk_text: feed LLM deltas, get each sentence back as soon as it is complete."""
+
+    def __init__(self, limit: int = MURF_MAX_CHARS):
+        self.limit = limit
+        self._buf = ""
+
+    def feed(self, delta: str) -> List[str]:
+        self._buf += delta
+        parts = SENTENCE_END.split(self._buf)
+        self._buf = parts.pop()  # tail may still be growing
+        out = []
+        for s in parts:
+            out.extend(chunk_text(s, self.limit))
+        while len(self._buf) > self.limit:  # no sentence end in sight
+            out.append(self._buf[:self.limit])
+            self._buf = self._buf[self.limit:]
+        return out
 
-def fallback_audio_url() -> str | None:
+    def flush(self) -> List[str]:
+        rest, self._buf = self._buf, ""
+        return chunk_text(rest, self.limit)
+
+async def _tts_chunk(chunk: str, voice_id: str, sem: asyncio.Semaphore) -> str:
+    url = tts_cache.get(chunk, voice_id)
+    if url:
+        metrics.TTS_CACHE.inc("hit")
+        return url
+    key = cache_key(chunk, voice_id, "mp3")
+    metrics.TTS_CACHE.inc("coalesced" if tts_flight.pending(key) else "miss")
+    return await tts_flight.do(key, lambda: _render_chunk(chunk, voice_id, sem))
+
+async def _render_chunk(chunk: str, voice_id: str, sem: asyncio.Semaphore) -> str:
+    async with sem:
+        with metrics.span("tts_chunk"):
+            for attempt in range(TTS_CHUNK_RETRIES + 1):
+                try:
+                    url = await providers.murf_generate(chunk, voice_id)
+                    break
+                except Exception as e:
+                    if attempt == TTS_CHUNK_RETRIES or not providers.is_retryable(e):
+                        raise
+                    print(f"[{metrics.trace_id()}] TTS chunk retry {attempt + 1}/{TTS_CHUNK_RETRIES}: {e}")
+                await asyncio.sleep(TTS_RETRY_BACKOFF * 2 ** attempt)
+    tts_cache.put(chunk, voice_id, url)
+    return url
+
+async def murf_tts(text: str, voice_id: str = DEFAULT_VOICE, fanout: int = TTS_FANOUT) -> List[str | None]:
+    """
+    Synthesize every chunk concurrently (at most `fanout` at a time); URLs keep
+    chunk order. A chunk that still fails after its retries is None, so callers
+    can keep the rest of the reply. Raises only when no chunk succeeded.
+    """
+    sem = asyncio.Semaphore(max(1, fanout))
+    tasks = [asyncio.ensure_future(_tts_chunk(c, voice_id, sem)) for c in chunk_text(text)]
+    results = await asyncio.gather(*tasks, return_exceptions=True)  # cancelling us cancels every chunk
+    failed = [(i, r) for i, r in enumerate(results) if isinstance(r, BaseException)]
+    if failed and len(failed) == len(results):
+        raise failed[0][1]
+    for i, e in failed:
+        print(f"[{metrics.trace_id()}] TTS chunk {i + 1}/{len(results)} failed, skipping: {e!r}")
+    return [None if isinstance(r, BaseException) else r for r in results]
+
+async def fallback_audio_url() -> str | None:
+    # Normally a local cache hit; only reaches Murf if the startup pre-render failed
     try:
-        urls = murf_tts(FALLBACK_TEXT)
-        return urls[0] if urls else None
+        with metrics.span("fallback"):
+            urls = await asyncio.wait_for(murf_tts(FALLBACK_TEXT), FALLBACK_TTS_TIMEOUT)
+        return next(filter(None, urls), None)
     except Exception:
-        print("Fallback audio failed:\n", traceback.format_exc())
+        print(f"[{metrics.trace_id()}] Fallback audio failed:\n", traceback.format_exc())
         return None
 
+async def preprocess_audio(path: str, content_type: str | None) -> bytes | str:
+    """Run audio_prep on the spooled upload; returns the smaller audio, or `path` to send it as recorded."""
+    data = await asyncio.to_thread(Path(path).read_bytes)
+    try:
+        out, report = await asyncio.to_thread(audio_prep.preprocess, data, content_type)
+    except audio_prep.SilentAudio:
+        metrics.PREP_RESULTS.inc("silent")
+        raise
+    for st in report.stages:
+        metrics.record(f"prep_{st.name}", st.ms / 1000)
+    if report.skipped:
+        metrics.PREP_RESULTS.inc("passthrough")
+        return path
+    metrics.PREP_RESULTS.inc("processed")
+    metrics.PREP_UPLOAD_SAVED.inc(amount=report.bytes_in - report.bytes_out)  # > 0: only smaller output is used
+    for st in report.stages:
+        metrics.PREP_BYTES_IN.inc(st.name, amount=st.bytes_in)
+        metrics.PREP_BYTES_OUT.inc(st.name, amount=st.bytes_out)
+        metrics.PREP_AUDIO_SAVED.inc(st.name, amount=st.audio_in - st.audio_out)
+    return out
+
+SYS_PROMPT = "You are a helpful assistant. Keep replies concise, friendly, and context-aware."
+
+def build_prompt(window: ContextWindow) -> str:
+    # window.lines are rendered once per message and already trimmed to budget
+    return "\n".join((SYS_PROMPT, "", *window.lines, "", "Assistant:"))
+
+@asynccontextmanager
+async def scheduled_turn(session_id: str | None = None):
+    """Per-session lock first (so queued follow-ups don't hold global slots), then an admission slot."""
+    if session_id is None:
+        async with admission.slot():
+            yield
+        return
+    async with session_locks.hold(session_id):
+        async with admission.slot():
+            yield
+
+def busy_response(e: scheduler.Overloaded, endpoint: str, body: dict) -> JSONResponse:
+    metrics.TURNS_SHED.inc(endpoint)
+    print(f"[{metrics.trace_id()}] Shed {endpoint} turn: {e}")
+    return JSONResponse({**body, "error": "Server busy, please retry"}, status_code=503,
+                        headers={"Retry-After": str(e.retry_after)})
+
 # ---------- Routes ----------
 @app.get("/")
 def root():
     return {"ok":True, "service":"My Assistant AI"}
 
 @app.get("/agent/history/{session_id}")
-def get_history(session_id: str):
-    return {"session_id": session_id, "history": history_store.get(session_id, [])}
+async def get_history(session_id: str):
+    return {"session_id": session_id, "history": await history_store.load(session_id, HISTORY_API_LIMIT)}
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.post("/agent/chat/{session_id}")
 async def agent_chat(session_id: str, file: UploadFile = File(...)):
@@ -117,97 +278,321 @@ async def agent_chat(session_id: str, file: UploadFile = File(...)):
     Audio -> STT (AssemblyAI) -> LLM (Gemini, with history) -> TTS (Murf)
     Robust error handling with spoken fallback.
     """
-    # 1) Read uploaded audio
     try:
-        audio_bytes = await file.read()
-        if not audio_bytes:
+        async with scheduled_turn(session_id):
+            with metrics.turn("chat") as turn:
+                result = await _chat_turn(session_id, file)
+                turn["outcome"] = "error" if isinstance(result, JSONResponse) else "ok"
+                return result
+    except scheduler.Overloaded as e:
+        return busy_response(e, "chat", {"transcript": None, "llm_reply": None, "audio_urls": []})
+
+async def _chat_turn(session_id: str, file: UploadFile):
+    # 1) Read uploaded audio (spooled chunk by chunk, size-capped)
+    prep = AUDIO_PREP and audio_prep.can_decode(file.content_type)
+    ingest = AudioIngest(INGEST_DIR, MAX_UPLOAD_BYTES, forward=STT_STREAM_UPLOAD and not prep)
+    try:
+        with metrics.span("read"):
+            while chunk := await file.read(UPLOAD_CHUNK):
+                await ingest.feed(chunk)
+                if ingest.overflow:
+                    break
+        if not ingest.size and not ingest.overflow:
             raise RuntimeError("Empty audio upload")
+        audio_source = await ingest.finish()  # raises UploadTooLarge on overflow
+    except UploadTooLarge:
+        ingest.discard()
+        fb = await fallback_audio_url()
+        return JSONResponse(
+            {"transcript": None, "llm_reply": None, "audio_urls": [fb] if fb else [], "error": "Audio upload too large"},
+            status_code=413
+        )
     except Exception as e:
-        fb = fallback_audio_url()
+        ingest.discard()
+        fb = await fallback_audio_url()
         return JSONResponse(
             {"transcript": None, "llm_reply": None, "audio_urls": [fb] if fb else [], "error": "Failed to read uploaded audio"},
             status_code=400
         )
 
+    # 1b) Preprocess: trim silence, downmix, resample; silent clips stop here
+    if prep:
+        try:
+            audio_source = await preprocess_audio(audio_source, file.content_type)
+        except audio_prep.SilentAudio as e:
+            ingest.discard()
+            return JSONResponse(
+                {"transcript": None, "llm_reply": None, "audio_urls": [], "error": "No speech detected"},
+                status_code=422
+            )
+        except Exception:
+            print(f"[{metrics.trace_id()}] Audio preprocessing failed, sending as recorded:", traceback.format_exc())
+
     # 2) STT
     try:
-        transcriber = aai.Transcriber()
-        t = transcriber.transcribe(audio_bytes)
-        user_text = (t.text or "").strip()
+        with metrics.span("stt"):
+            user_text = await providers.transcribe(audio_source)
         if not user_text:
             raise RuntimeError("Empty transcript from STT")
     except Exception as e:
-        print("STT error:", traceback.format_exc())
-        fb = fallback_audio_url()
+        print(f"[{metrics.trace_id()}] STT error:", traceback.format_exc())
+        fb = await fallback_audio_url()
         return JSONResponse(
             {"transcript": None, "llm_reply": None, "audio_urls": [fb] if fb else [], "error": "Speech-to-Text failed"},
             status_code=502
         )
+    finally:
+        ingest.discard()
 
     # 3) Append to history
-    hist = history_store.setdefault(session_id, [])
-    hist.append({"role":"user","content":user_text})
-    if len(hist) > MAX_HISTORY:
-        history_store[session_id] = hist[-MAX_HISTORY:]
-        hist = history_store[session_id]
+    with metrics.span("history"):
+        window = await history_store.window(session_id)
+    history_store.append(session_id, "user", user_text)
 
     # 4) Build LLM prompt with history
-    sys_prompt = "You are a helpful assistant. Keep replies concise, friendly, and context-aware."
-    lines = [sys_prompt, ""]
-    for m in hist:
-        if m["role"] == "user":
-            lines.append(f"User: {m['content']}")
-        else:
-            lines.append(f"Assistant: {m['content']}")
-    lines.append("")
-    lines.append("Assistant:")
-    prompt = "\n".join(lines)
+    with metrics.span("prompt"):
+        prompt = build_prompt(window)
 
     # 5) LLM
     try:
-        if not gemini_client:
-            raise RuntimeError("GEMINI_API_KEY not configured")
-        resp = gemini_client.models.generate_content(model="gemini-2.5-flash", contents=prompt)
-        ai_text = (getattr(resp, "text", None) or "").strip()
+        with metrics.span("llm"):
+            ai_text = await providers.generate(prompt)
         if not ai_text:
             raise RuntimeError("Empty LLM reply")
     except Exception as e:
-        print("LLM error:", traceback.format_exc())
-        hist.append({"role":"assistant","content":FALLBACK_TEXT})
-        history_store[session_id] = hist
-        fb = fallback_audio_url()
+        print(f"[{metrics.trace_id()}] LLM error:", traceback.format_exc())
+        history_store.append(session_id, "assistant", FALLBACK_TEXT)
+        fb = await fallback_audio_url()
         return JSONResponse(
             {"transcript": user_text, "llm_reply": FALLBACK_TEXT, "audio_urls": [fb] if fb else [], "error": "LLM generation failed"},
             status_code=502
         )
 
     # 6) Append AI msg
-    hist.append({"role":"assistant","content":ai_text})
-    if len(hist) > MAX_HISTORY:
-        history_store[session_id] = hist[-MAX_HISTORY:]
+    history_store.append(session_id, "assistant", ai_text)
 
     # 7) TTS
     try:
-        urls = murf_tts(ai_text)
+        with metrics.span("tts"):
+            urls = await murf_tts(ai_text)
     except Exception as e:
-        print("TTS error:", traceback.format_exc())
-        fb = fallback_audio_url()
+        print(f"[{metrics.trace_id()}] TTS error:", traceback.format_exc())
+        fb = await fallback_audio_url()
         return JSONResponse(
             {"transcript": user_text, "llm_reply": ai_text, "audio_urls": [fb] if fb else [], "error": "TTS generation failed"},
             status_code=502
         )
 
-    # 8) Done
-    return {"transcript": user_text, "llm_reply": ai_text, "audio_urls": urls, "error": None}
+    # 8) Done — chunks that failed after retries are left out, the rest still plays
+    spoken = [u for u in urls if u]
+    return {"transcript": user_text, "llm_reply": ai_text, "audio_urls": spoken,
+            "error": None if len(spoken) == len(urls) else "Part of the reply could not be voiced"}
+
+# ---------- Streaming turn (WebSocket) ----------
+@app.websocket("/agent/stream/{session_id}")
+async def agent_stream(ws: WebSocket, session_id: str):
+    """
+    Same pipeline as /agent/chat, but streamed: the client sends timesliced
+    recording chunks as binary frames *while the user speaks* (they are spooled
+    and forwarded to AssemblyAI on the fly), then {"type":"end"}; the server answers with
+    transcript -> delta* / audio* -> done (or error) messages, starting TTS for
+    each sentence as soon as Gemini finishes it. The socket stays open for the
+    next turn. The first audio frame must get a place under MAX_OPEN_RECORDINGS
+    before any upload starts (otherwise the client is told right away and the
+    rest of the recording is discarded); the turn slot is taken at "end".
+    """
+    await ws.accept()
+    try:
+        while True:
+            await _stream_turn(ws, session_id, await _next_frame(ws))
+    except WebSocketDisconnect:
+        pass
+
+def _control_type(text: str) -> str | None:
+    """`type` of a JSON control frame; malformed frames are ignored rather than killing the socket."""
+    try:
+        msg = json.loads(text)
+    except ValueError:
+        msg = None
+    if not isinstance(msg, dict):
+        print(f"[{metrics.trace_id()}] Ignoring malformed control frame: {text[:100]!r}")
+        return None
+    return msg.get("type")
+
+async def _next_frame(ws: WebSocket) -> bytes | None:
+    """Next audio frame of the current recording; None once the client sends {"type":"end"}."""
+    while True:
+        msg = await ws.receive()
+        if msg["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(msg.get("code", 1000))
+        if msg.get("bytes"):
+            return msg["bytes"]
+        if msg.get("text") and _control_type(msg["text"]) == "end":
+            return None
+
+async def _receive_audio(ws: WebSocket, first: bytes | None) -> AudioIngest | None:
+    if first is None:
+        return None
+    ingest = AudioIngest(INGEST_DIR, MAX_UPLOAD_BYTES, forward=STT_STREAM_UPLOAD)
+    try:
+        frame = first
+        while frame is not None:
+            await ingest.feed(frame)
+            frame = await _next_frame(ws)
+        return ingest
+    except BaseException:
+        ingest.discard()
+        raise
+
+async def _drain_audio(ws: WebSocket, first: bytes | None):
+    while first is not None:
+        first = await _next_frame(ws)
+
+async def _send_error(ws: WebSocket, error: str, transcript: str | None = None, llm_reply: str | None = None):
+    fb = await fallback_audio_url()
+    await ws.send_json({"type":"error","transcript":transcript,"llm_reply":llm_reply,"audio_urls":[fb] if fb else [],"error":error,
+                        "trace_id":metrics.trace_id()})
+
+async def _speak(ws: WebSocket, pending: asyncio.Queue, t0: float) -> List[str]:
+    """Send each sentence's audio URL in sentence order as soon as it is ready; failed sentences are skipped."""
+    urls, failed = [], 0
+    while (task := await pending.get()) is not None:
+        try:
+            url = await task
+        except Exception as e:
+            print(f"[{metrics.trace_id()}] TTS sentence failed, skipping: {e!r}")
+            failed += 1
+            continue
+        if not urls:
+            metrics.record("first_audio", time.perf_counter() - t0)
+        await ws.send_json({"type":"audio","index":len(urls),"url":url})
+        urls.append(url)
+    if failed and not urls:
+        raise RuntimeError(f"All {failed} TTS sentences failed")
+    return urls
+
+def _cancel_pending(pending: asyncio.Queue):
+    while not pending.empty():
+        task = pending.get_nowait()
+        if task is not None:
+            task.cancel()
+
+async def _stream_turn(ws: WebSocket, session_id: str, first: bytes | None):
+    metrics.start_trace()  # one trace per turn; timings ride on the done message
+    try:
+        # the upload to AssemblyAI starts with the first frame: bounded by the recordings cap
+        with recordings.hold():
+            ingest = await _receive_audio(ws, first)
+    except scheduler.Overloaded as e:
+        await _send_busy(ws, e)
+        await _drain_audio(ws, first)
+        return
+    try:
+        # the turn slot covers STT -> TTS only, from {"type":"end"} on
+        async with scheduled_turn(session_id):
+            with metrics.turn("stream") as turn:
+                turn["outcome"] = await _run_stream_turn(ws, session_id, ingest)
+    except scheduler.Overloaded as e:
+        if ingest is not None:
+            ingest.discard()
+        await _send_busy(ws, e)
+
+async def _send_busy(ws: WebSocket, e: scheduler.Overloaded):
+    metrics.TURNS_SHED.inc("stream")
+    print(f"[{metrics.trace_id()}] Shed stream turn: {e}")
+    await ws.send_json({"type":"error","transcript":None,"llm_reply":None,"audio_urls":[],"error":"Server busy, please retry",
+                        "retry_after":e.retry_after,"trace_id":metrics.trace_id()})
+
+async def _run_stream_turn(ws: WebSocket, session_id: str, ingest: AudioIngest | None) -> str:
+    t0 = time.perf_counter()
+    if ingest is None or not (ingest.size or ingest.overflow):
+        if ingest is not None:
+            ingest.discard()
+        await _send_error(ws, "Failed to read uploaded audio")
+        return "error"
+
+    # 1) STT (the upload has been streaming since the first chunk)
+    try:
+        with metrics.span("stt"):
+            user_text = await providers.transcribe(await ingest.finish())
+        if not user_text:
+            raise RuntimeError("Empty transcript from STT")
+    except UploadTooLarge:
+        await _send_error(ws, "Audio upload too large")
+        return "error"
+    except Exception:
+        print(f"[{metrics.trace_id()}] STT error:", traceback.format_exc())
+        await _send_error(ws, "Speech-to-Text failed")
+        return "error"
+    finally:
+        ingest.discard()
+    await ws.send_json({"type":"transcript","text":user_text})
+    with metrics.span("history"):
+        window = await history_store.window(session_id)
+    history_store.append(session_id, "user", user_text)
+    with metrics.span("prompt"):
+        prompt = build_prompt(window)
+
+    # 2) LLM deltas -> sentences -> TTS tasks, spoken in order by _speak
+    pending: asyncio.Queue = asyncio.Queue()
+    speaker = asyncio.create_task(_speak(ws, pending, t0))
+    fanout = asyncio.Semaphore(max(1, TTS_FANOUT))
+    splitter = SentenceStream()
+    parts = []
+
+    def enqueue(sentences: List[str]):
+        for s in sentences:
+            pending.put_nowait(asyncio.create_task(_tts_chunk(s, DEFAULT_VOICE, fanout)))
+
+    try:
+        with metrics.span("llm"):
+            async for delta in providers.generate_stream(prompt):
+                parts.append(delta)
+                await ws.send_json({"type":"delta","text":delta})
+                enqueue(splitter.feed(delta))
+            enqueue(splitter.flush())
+        ai_text = "".join(parts).strip()
+        if not ai_text:
+            raise RuntimeError("Empty LLM reply")
+    except WebSocketDisconnect:
+        speaker.cancel()
+        _cancel_pending(pending)
+        raise
+    except Exception:
+        print(f"[{metrics.trace_id()}] LLM error:", traceback.format_exc())
+        speaker.cancel()
+        _cancel_pending(pending)
+        history_store.append(session_id, "assistant", FALLBACK_TEXT)
+        await _send_error(ws, "LLM generation failed", user_text, FALLBACK_TEXT)
+        return "error"
+    history_store.append(session_id, "assistant", ai_text)
+
+    # 3) Wait for the remaining sentences to be spoken
+    pending.put_nowait(None)
+    try:
+        with metrics.span("tts_tail"):
+            urls = await speaker
+    except Exception:
+        print(f"[{metrics.trace_id()}] TTS error:", traceback.format_exc())
+        _cancel_pending(pending)
+        await _send_error(ws, "TTS generation failed", user_text, ai_text)
+        return "error"
+    trace = metrics.current_trace()
+    await ws.send_json({"type":"done","transcript":user_text,"llm_reply":ai_text,"audio_urls":urls,"error":None,
+                        "trace_id":trace.id,"timings":trace.timings()})
+    return "ok"
 
 # Optional: simple TTS text endpoint for testing
 class TTSIn(BaseModel):
     text: str
 
 @app.post("/tts")
-def tts_text(payload: TTSIn):
+async def tts_text(payload: TTSIn):
     try:
-        urls = murf_tts(payload.text)
-        return {"audio_url": urls[0] if urls else None}
+        async with scheduled_turn():
+            urls = await murf_tts(payload.text)
+        return {"audio_url": next(filter(None, urls), None)}
+    except scheduler.Overloaded as e:
+        return busy_response(e, "tts", {"audio_url": None})
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
@@ -0,0 +1,272 @@
+# history.py — pluggable chat history backends + budgeted prompt context
+#
+# Both backends keep a bounded LRU of "hot" sessions in memory, each holding a
+# ContextWindow: the most recent messages that fit the prompt budget, already
+# rendered as prompt lines, so a turn only renders the newest message instead
+# of rebuilding the whole history. Idle sessions are evicted, so memory stays
+# flat no matter how many sessions have ever been seen.
+#
+# SQLiteHistoryStore is the durable one: WAL mode (many readers, one writer,
+# shared by every uvicorn worker on the host), rows indexed on
+# (session_id, timestamp), and writes batched on a background thread so the
+# request path never waits on disk. Before a hot window is reused, one indexed
+# MAX(id) lookup checks that no other worker has written to the session since;
+# a window that is behind is reloaded.
+import time
+import queue
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+def render_line(role: str, content: str) -> str:
+    return f"User: {content}" if role == "user" else f"Assistant: {content}"
+
+class ContextWindow:
+    """Newest messages of one session that fit in `budget` characters of prompt."""
+    __slots__ = ("budget", "messages", "lines", "chars", "touched", "synced_id")
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.messages: deque = deque()
+        self.lines: deque = deque()
+        self.chars = 0
+        self.touched = time.monotonic()
+        self.synced_id = 0  # newest committed row this window is known to reflect
+
+    def push(self, role: str, content: str):
+        line = render_line(role, content)
+        self.messages.append({"role":role,"content":content})
+        self.lines.append(line)
+        self.chars += len(line) + 1
+        # always keep the newest message, even if it alone is over budget
+        while self.chars > self.budget and len(self.lines) > 1:
+            self.chars -= len(self.lines.popleft()) + 1
+            self.messages.popleft()
+
+class HistoryStore:
+    """Base: LRU of hot ContextWindows with idle eviction. Subclasses add persistence."""
+
+    def __init__(self, budget: int = 8000, max_sessions: int = 1000, idle_ttl: float = 900):
+        self.budget = budget
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._hot: "OrderedDict[str, ContextWindow]" = OrderedDict()
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._hot:
+            sid, w = next(iter(self._hot.items()))
+            if len(self._hot) <= self.max_sessions and now - w.touched < self.idle_ttl:
+                break
+            del self._hot[sid]
+            self._forget(sid)
+
+    def _forget(self, session_id: str):
+        pass
+
+    def _cached(self, session_id: str) -> Optional[ContextWindow]:
+        w = self._hot.get(session_id)
+        if w is not None:
+            w.touched = time.monotonic()
+            self._hot.move_to_end(session_id)
+        return w
+
+    def _admit(self, session_id: str, w: ContextWindow) -> ContextWindow:
+        self._hot[session_id] = w
+        self._hot.move_to_end(session_id)
+        self._evict()
+        return w
+
+    async def window(self, session_id: str) -> ContextWindow:
+        return self._cached(session_id) or self._admit(session_id, ContextWindow(self.budget))
+
+    def append(self, session_id: str, role: str, content: str):
+        """Record a message. Never blocks: persistence (if any) happens off the request path."""
+        w = self._cached(session_id)
+        if w is not None:
+            w.push(role, content)
+        self._persist(session_id, role, content)
+
+    def _persist(self, session_id: str, role: str, content: str):
+        pass
+
+    async def load(self, session_id: str, limit: int = 100) -> List[Dict[str, str]]:
+        w = self._cached(session_id)
+        return list(w.messages)[-limit:] if w else []
+
+    async def aclose(self):
+        pass
+
+class MemoryHistoryStore(HistoryStore):
+    """Process-local history (dev / tests): only the hot windows, lost on restart."""
+
+    def append(self, session_id: str, role: str, content: str):
+        w = self._cached(session_id) or self._admit(session_id, ContextWindow(self.budget))
+        w.push(role, content)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    message TEXT NOT NULL,
+    timestamp REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chat_history_session_ts ON chat_history (session_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_chat_history_session_id ON chat_history (session_id, id);
+"""
+INSERT_ROW = "INSERT INTO chat_history (session_id, role, message, timestamp) VALUES (?, ?, ?, ?)"
+NEWEST_ID = "SELECT MAX(id) FROM chat_history WHERE session_id = ?"
+
+class SQLiteHistoryStore(HistoryStore):
+    def __init__(self, path: str, batch_size: int = 200, flush_interval: float = 0.05,
+                 load_limit: int = 200, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.load_limit = load_limit
+        self._queue: "queue.Queue" = queue.Queue()
+        self._pending: Dict[str, int] = {}  # session_id -> rows queued but not yet committed
+        # session_id -> (newest id before our commits, newest id after), for hot sessions;
+        # lets a window count its own writes as synced without reloading
+        self._written: Dict[str, Tuple[int, int]] = {}
+        self._pending_cv = threading.Condition()
+        self._read_lock = threading.Lock()
+        self._reader = self._connect()
+        self._reader.executescript(SCHEMA)
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    # ---------- Writes (background thread) ----------
+    def _persist(self, session_id: str, role: str, content: str):
+        with self._pending_cv:
+            self._pending[session_id] = self._pending.get(session_id, 0) + 1
+        self._queue.put((session_id, role, content, time.time()))
+
+    def _write_loop(self):
+        conn = self._connect()
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            batch = []
+            # the deadline counts from the first row, so a steady trickle can't hold a batch open
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    stop = True
+                else:
+                    batch.append(item)
+                remaining = deadline - time.monotonic()
+                if stop or len(batch) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            spans = {}
+            try:
+                if batch:
+                    with conn:
+                        conn.execute("BEGIN IMMEDIATE")  # no other worker can write between MAX(id) and INSERT
+                        spans = self._insert(conn, batch)
+            except Exception as e:
+                spans = {}
+                print(f"History write failed ({len(batch)} rows dropped): {e}")
+            finally:
+                with self._pending_cv:
+                    for sid, (before, after) in spans.items():
+                        if sid not in self._hot:
+                            continue
+                        prev = self._written.get(sid)
+                        if prev is not None:
+                            # another worker wrote in between our batches: force a reload
+                            before = prev[0] if prev[1] == before else -1
+                        self._written[sid] = (before, after)
+                    for sid, *_ in batch:
+                        if self._pending[sid] <= 1:
+                            del self._pending[sid]
+                        else:
+                            self._pending[sid] -= 1
+                    self._pending_cv.notify_all()
+                for _ in range(len(batch) + stop):
+                    self._queue.task_done()
+        conn.close()
+
+    def _insert(self, conn: sqlite3.Connection, batch: list) -> Dict[str, Tuple[int, int]]:
+        """Insert one batch; -> session_id -> (newest id before the batch, newest id after)."""
+        spans: Dict[str, Tuple[int, int]] = {}
+        for sid, role, content, ts in batch:
+            if sid in spans:
+                before = spans[sid][0]
+            else:
+                before = conn.execute(NEWEST_ID, (sid,)).fetchone()[0] or 0
+            spans[sid] = (before, conn.execute(INSERT_ROW, (sid, role, content, ts)).lastrowid)
+        return spans
+
+    def _forget(self, session_id: str):
+        with self._pending_cv:
+            self._written.pop(session_id, None)
+
+    # ---------- Reads ----------
+    def _wait_pending(self, session_id: str):
+        with self._pending_cv:  # this session's queued writes must be visible first
+            self._pending_cv.wait_for(lambda: session_id not in self._pending)
+
+    def _rows(self, session_id: str, limit: int) -> List[tuple]:
+        self._wait_pending(session_id)
+        with self._read_lock:
+            rows = self._reader.execute(
+                "SELECT id, role, message FROM chat_history WHERE session_id = ? "
+                "ORDER BY timestamp DESC, id DESC LIMIT ?",
+                (session_id, limit),
+            ).fetchall()
+        rows.reverse()
+        return rows
+
+    def _apply_written(self, session_id: str, w: ContextWindow):
+        with self._pending_cv:
+            written = self._written.pop(session_id, None)
+        if written is not None and written[0] == w.synced_id:
+            w.synced_id = written[1]  # our own rows: already pushed into the window
+
+    def _in_sync(self, session_id: str, w: ContextWindow) -> bool:
+        """
+        True unless another writer has committed rows `w` lacks. Never waits for
+        our own queued rows: the hot window already holds them.
+        """
+        self._apply_written(session_id, w)
+        with self._read_lock:
+            newest = self._reader.execute(NEWEST_ID, (session_id,)).fetchone()[0] or 0
+        self._apply_written(session_id, w)  # our batch may have committed during the query
+        return w.synced_id >= newest
+
+    async def window(self, session_id: str) -> ContextWindow:
+        w = self._cached(session_id)
+        if w is not None and await asyncio.to_thread(self._in_sync, session_id, w):
+            return w
+        rows = await asyncio.to_thread(self._rows, session_id, self.load_limit)
+        w = ContextWindow(self.budget)
+        for row_id, role, message in rows:
+            w.push(role, message)
+            w.synced_id = max(w.synced_id, row_id)
+        self._forget(session_id)
+        return self._admit(session_id, w)
+
+    async def load(self, session_id: str, limit: int = 100) -> List[Dict[str, str]]:
+        rows = await asyncio.to_thread(self._rows, session_id, limit)
+        return [{"role":role,"content":message} for _, role, message in rows]
+
+    async def aclose(self):
+        self._queue.put(None)
+        await asyncio.to_thread(self._writer.join)
+        self._reader.close()
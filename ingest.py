@@ -0,0 +1,108 @@
+# ingest.py — incremental audio ingestion (overlaps upload/STT with recording)
+#
+# The browser sends timesliced MediaRecorder chunks while the user is still
+# speaking. Each chunk is spooled to disk (never the whole recording in RAM),
+# checked against the upload size limit, and forwarded through a bounded queue
+# to a streaming AssemblyAI upload. By the time recording stops the audio is
+# already on AssemblyAI's side, so transcription can start immediately.
+import os
+import json
+import asyncio
+import tempfile
+import traceback
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+import providers
+
+class UploadTooLarge(RuntimeError):
+    pass
+
+class UploadLimitMiddleware:
+    """
+    Pure ASGI middleware: 413 before the body is read when Content-Length is over
+    the limit. Form parsing spools the whole multipart body before a handler
+    runs, so AudioIngest's own cap alone would not bound what the server accepts.
+    """
+
+    def __init__(self, app, max_bytes: int, paths=("/agent/chat",), slack: int = 64 * 1024):
+        self.app = app
+        self.max_body = max_bytes + slack  # multipart boundaries and headers
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith(self.paths):
+            length = dict(scope["headers"]).get(b"content-length")
+            if length is not None and length.isdigit() and int(length) > self.max_body:
+                body = json.dumps({"transcript": None, "llm_reply": None, "audio_urls": [],
+                                   "error": "Audio upload too large"}).encode()
+                await send({"type": "http.response.start", "status": 413,
+                            "headers": [(b"content-type", b"application/json"), (b"connection", b"close")]})
+                await send({"type": "http.response.body", "body": body})
+                return
+        await self.app(scope, receive, send)
+
+class AudioIngest:
+    def __init__(self, spool_dir: Path, max_bytes: int, forward: bool = True, queue_chunks: int = 64):
+        spool_dir.mkdir(parents=True, exist_ok=True)
+        fd, name = tempfile.mkstemp(dir=spool_dir, suffix=".audio")
+        self.path = Path(name)
+        self._spool = os.fdopen(fd, "wb")
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.overflow = False
+        self._queue: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue(maxsize=queue_chunks)
+        self._upload: Optional[asyncio.Task] = None
+        if forward:
+            self._upload = asyncio.create_task(providers.stt_upload(self._chunks()))
+
+    async def _chunks(self) -> AsyncIterator[bytes]:
+        while (data := await self._queue.get()) is not None:
+            yield data
+
+    def _stop_forwarding(self):
+        if self._upload is not None:
+            if self._upload.done() and not self._upload.cancelled() and self._upload.exception():
+                print("Streaming upload failed, will transcribe from spool:", self._upload.exception())
+            self._upload.cancel()
+            self._upload = None
+
+    async def _forward(self, item: Optional[bytes]) -> bool:
+        """Queue an item for the upload; False (and forwarding stops) if the upload has died."""
+        put = asyncio.ensure_future(self._queue.put(item))
+        await asyncio.wait({put, self._upload}, return_when=asyncio.FIRST_COMPLETED)
+        if put.done():
+            return True
+        put.cancel()
+        self._stop_forwarding()
+        return False
+
+    async def feed(self, data: bytes):
+        """Spool one chunk and pass it on to the upload (waits if the upload falls behind)."""
+        if self.overflow:
+            return
+        if self.size + len(data) > self.max_bytes:
+            self.overflow = True
+            self._stop_forwarding()
+            return
+        self.size += len(data)
+        self._spool.write(data)
+        if self._upload is not None:
+            await self._forward(data)
+
+    async def finish(self) -> str:
+        """End of recording: returns what to transcribe — the upload URL, or the spool path."""
+        self._spool.close()
+        if self.overflow:
+            raise UploadTooLarge(f"Audio upload exceeds {self.max_bytes} bytes")
+        if self._upload is not None and await self._forward(None):
+            try:
+                return await self._upload
+            except Exception:
+                print("Streaming upload failed, using spooled file:\n", traceback.format_exc())
+        return str(self.path)
+
+    def discard(self):
+        self._stop_forwarding()
+        self._spool.close()
+        self.path.unlink(missing_ok=True)
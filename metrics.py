@@ -0,0 +1,178 @@
+# metrics.py — per-stage latency spans, trace IDs and a Prometheus-style /metrics
+#
+# Cheap enough to leave on: a span is two perf_counter() calls, a bisect and a
+# list append; there are no locks, threads or exporters. Each HTTP request (and
+# each streaming turn) gets a Trace carried in a ContextVar, so spans recorded
+# deep in the pipeline — including TTS chunks running in their own tasks — land
+# on the right request and come back as a `Server-Timing` header.
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *values: str, amount: float = 1):
+        self._values[values] = self._values.get(values, 0) + amount
+
+    def render(self, kind: str = "counter") -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {kind}"]
+        for values, v in sorted(self._values.items()):
+            out.append(f"{self.name}{_labels(self.labels, values)} {v:g}")
+        return out
+
+class Gauge(Counter):
+    def dec(self, *values: str, amount: float = 1):
+        self.inc(*values, amount=-amount)
+
+    def render(self, kind: str = "gauge") -> List[str]:
+        return super().render(kind)
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self._series: Dict[Tuple[str, ...], list] = {}  # values -> [bucket counts..., +Inf, sum]
+
+    def observe(self, value: float, *values: str):
+        s = self._series.get(values)
+        if s is None:
+            s = self._series[values] = [0] * (len(self.buckets) + 2)
+        s[bisect_left(self.buckets, value)] += 1
+        s[-1] += value
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, s in sorted(self._series.items()):
+            acc = 0
+            for le, n in zip((*self.buckets, "+Inf"), s[:-1]):
+                acc += n
+                le_label = 'le="%s"' % le
+                out.append(f"{self.name}_bucket{_labels(self.labels, values, le_label)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labels, values)} {s[-1]:.6f}")
+            out.append(f"{self.name}_count{_labels(self.labels, values)} {acc}")
+        return out
+
+STAGE_SECONDS = Histogram("voice_stage_seconds", "Latency of each voice pipeline stage", ("stage",))
+PROVIDER_SECONDS = Histogram("voice_provider_seconds", "Latency of external provider calls", ("provider",))
+PROVIDER_ERRORS = Counter("voice_provider_errors_total", "Failed external provider calls", ("provider",))
+TURNS = Counter("voice_turns_total", "Completed conversation turns", ("endpoint", "outcome"))
+TURNS_IN_FLIGHT = Gauge("voice_turns_in_flight", "Conversation turns currently being processed", ("endpoint",))
+TURNS_QUEUED = Gauge("voice_turns_queued", "Conversation turns waiting for an admission slot")
+TURNS_SHED = Counter("voice_turns_shed_total", "Turns rejected by admission control (503)", ("endpoint",))
+TTS_CACHE = Counter("voice_tts_cache_total", "TTS chunk lookups by cache result", ("result",))
+# per-stage sizes as separate in/out counters: a stage may grow its input (decode, WAV header)
+PREP_BYTES_IN = Counter("voice_prep_stage_bytes_in_total", "Bytes entering each preprocessing stage", ("stage",))
+PREP_BYTES_OUT = Counter("voice_prep_stage_bytes_out_total", "Bytes leaving each preprocessing stage", ("stage",))
+PREP_UPLOAD_SAVED = Counter("voice_prep_upload_bytes_saved_total", "Bytes not sent to STT versus the original uploads")
+PREP_AUDIO_SAVED = Counter("voice_prep_audio_seconds_saved_total", "Audio seconds not sent to STT, per preprocessing stage", ("stage",))
+PREP_RESULTS = Counter("voice_prep_total", "Preprocessed uploads by result", ("result",))
+REGISTRY = [STAGE_SECONDS, PROVIDER_SECONDS, PROVIDER_ERRORS, TURNS, TURNS_IN_FLIGHT, TURNS_QUEUED, TURNS_SHED,
+            TTS_CACHE, PREP_BYTES_IN, PREP_BYTES_OUT, PREP_UPLOAD_SAVED, PREP_AUDIO_SAVED, PREP_RESULTS]
+
+def render() -> str:
+    lines = []
+    for m in REGISTRY:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+# ---------- Traces ----------
+class Trace:
+    __slots__ = ("id", "spans", "_seen")
+
+    def __init__(self, trace_id: Optional[str] = None):
+        self.id = trace_id or uuid.uuid4().hex[:16]
+        self.spans: List[Tuple[str, float]] = []
+        self._seen: Dict[str, int] = {}
+
+    def add(self, name: str, seconds: float):
+        # repeated stages (one per TTS chunk) become tts_chunk, tts_chunk_1, ...
+        n = self._seen.get(name, 0)
+        self._seen[name] = n + 1
+        self.spans.append((f"{name}_{n}" if n else name, seconds))
+
+    def timings(self) -> Dict[str, float]:
+        return {name: round(sec * 1000, 1) for name, sec in self.spans}
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={sec * 1000:.1f}" for name, sec in self.spans)
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("voice_trace", default=None)
+
+def start_trace(trace_id: Optional[str] = None) -> Trace:
+    trace = Trace(trace_id)
+    _trace.set(trace)
+    return trace
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+def trace_id() -> str:
+    t = _trace.get()
+    return t.id if t else "-"
+
+def record(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage)
+    t = _trace.get()
+    if t is not None:
+        t.add(stage, seconds)
+
+@contextmanager
+def span(stage: str):
+    """Time a pipeline stage into the stage histogram and the current request's trace."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - t0)
+
+@contextmanager
+def turn(endpoint: str):
+    """Count a turn as in flight while the block runs; the block sets `outcome["outcome"]`."""
+    outcome = {"outcome": "error"}
+    TURNS_IN_FLIGHT.inc(endpoint)
+    try:
+        with span("turn"):
+            yield outcome
+    finally:
+        TURNS_IN_FLIGHT.dec(endpoint)
+        TURNS.inc(endpoint, outcome["outcome"])
+
+class TraceMiddleware:
+    """Pure ASGI middleware: one Trace per HTTP request, returned as Server-Timing + X-Request-ID."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        rid = dict(scope["headers"]).get(b"x-request-id")
+        trace = Trace(rid.decode("latin-1")[:64] if rid else None)
+        token = _trace.set(trace)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-request-id", trace.id.encode("latin-1")))
+                if trace.spans:
+                    headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _trace.reset(token)
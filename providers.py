@@ -0,0 +1,207 @@
+# providers.py — async STT / LLM / TTS provider layer for the voice pipeline
+#
+# Every external service sits behind a `Provider` envelope that caps how many
+# calls may be in flight at once and how long each one may take. HTTP providers
+# share one pooled keep-alive client; SDKs that only expose blocking calls run
+# on a bounded thread pool so they never stall the event loop.
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+
+import assemblyai as aai
+from google import genai  # Gemini client
+
+import metrics
+
+# ---------- Config & Clients ----------
+load_dotenv()
+
+MURF_API_KEY = os.getenv("MURF_API_KEY")
+ASSEMBLYAI_API_KEY = os.getenv("ASSEMBLYAI_API_KEY")
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+
+aai.settings.api_key = ASSEMBLYAI_API_KEY
+
+gemini_client = None
+if GEMINI_API_KEY:
+    gemini_client = genai.Client(api_key=GEMINI_API_KEY)
+
+MURF_API = "https://api.murf.ai/v1/speech/generate"
+ASSEMBLYAI_UPLOAD = "https://api.assemblyai.com/v2/upload"
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+
+# Per-provider limits: max calls in flight and seconds allowed per call
+STT_CONCURRENCY = int(os.getenv("STT_CONCURRENCY", "8"))
+STT_TIMEOUT = float(os.getenv("STT_TIMEOUT", "60"))
+STT_POLL_INTERVAL = float(os.getenv("STT_POLL_INTERVAL", "0.5"))
+STT_HTTP_TIMEOUT = float(os.getenv("STT_HTTP_TIMEOUT", "15"))  # per SDK request, so no pool thread hangs
+aai.settings.http_timeout = STT_HTTP_TIMEOUT
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "16"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", "16"))
+TTS_TIMEOUT = float(os.getenv("TTS_TIMEOUT", "60"))
+
+# Shared pools
+BLOCKING_POOL_SIZE = int(os.getenv("BLOCKING_POOL_SIZE", "16"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "64"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "32"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+
+_blocking_pool = ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="provider")
+_http: Optional[httpx.AsyncClient] = None
+
+# ---------- Provider envelope ----------
+class ProviderError(RuntimeError):
+    """A provider call failed; `retryable` marks transient failures (timeouts, 429, 5xx)."""
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+def is_retryable(exc: BaseException) -> bool:
+    return isinstance(exc, httpx.TransportError) or getattr(exc, "retryable", False)
+
+class Provider:
+    """Concurrency limit + timeout shared by every call to one external service."""
+
+    def __init__(self, name: str, concurrency: int, timeout: float):
+        self.name = name
+        self.timeout = timeout
+        self._sem = asyncio.Semaphore(concurrency)
+
+    def error(self, message: str, retryable: bool = False) -> ProviderError:
+        """Build a ProviderError for a bad response, counting it against this provider."""
+        metrics.PROVIDER_ERRORS.inc(self.name)
+        return ProviderError(message, retryable)
+
+    async def call(self, fn, *args, **kwargs):
+        """Await `fn(*args, **kwargs)` once a slot is free, bounded by the provider timeout."""
+        async with self._sem:
+            t0 = time.perf_counter()
+            try:
+                return await asyncio.wait_for(fn(*args, **kwargs), self.timeout)
+            except asyncio.TimeoutError:
+                raise self.error(f"{self.name} timed out after {self.timeout:g}s", retryable=True) from None
+            except Exception:
+                metrics.PROVIDER_ERRORS.inc(self.name)
+                raise
+            finally:
+                metrics.PROVIDER_SECONDS.observe(time.perf_counter() - t0, self.name)
+
+    async def stream(self, fn, *args, **kwargs):
+        """Iterate the async stream returned by `fn` while holding a slot; the timeout applies per item."""
+        async with self._sem:
+            t0 = time.perf_counter()
+            try:
+                it = (await asyncio.wait_for(fn(*args, **kwargs), self.timeout)).__aiter__()
+                while True:
+                    try:
+                        item = await asyncio.wait_for(it.__anext__(), self.timeout)
+                    except StopAsyncIteration:
+                        return
+                    yield item
+            except asyncio.TimeoutError:
+                raise self.error(f"{self.name} stream stalled for {self.timeout:g}s", retryable=True) from None
+            except Exception:
+                metrics.PROVIDER_ERRORS.inc(self.name)
+                raise
+            finally:
+                metrics.PROVIDER_SECONDS.observe(time.perf_counter() - t0, self.name)
+
+def _in_pool(fn, *args, **kwargs):
+    """
+    The one way into the bounded thread pool for sync-only SDK calls. Use it for
+    short, individually time-bounded requests inside `Provider.call`; never for
+    calls that block until a job finishes, which would pin a thread past the timeout.
+    """
+    return asyncio.get_running_loop().run_in_executor(_blocking_pool, partial(fn, *args, **kwargs))
+
+stt = Provider("assemblyai", STT_CONCURRENCY, STT_TIMEOUT)
+llm = Provider("gemini", LLM_CONCURRENCY, LLM_TIMEOUT)
+tts = Provider("murf", TTS_CONCURRENCY, TTS_TIMEOUT)
+
+def http_client() -> httpx.AsyncClient:
+    """Pooled keep-alive client reused by every HTTP provider call."""
+    global _http
+    if _http is None or _http.is_closed:
+        _http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+            timeout=httpx.Timeout(TTS_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        )
+    return _http
+
+async def aclose():
+    global _http
+    if _http is not None:
+        await _http.aclose()
+        _http = None
+
+# ---------- Calls ----------
+async def transcribe(audio) -> str:
+    """
+    Audio bytes / path / URL -> transcript text. The SDK is sync-only, so submit
+    and each status check run on the pool, but the wait between polls is an
+    async sleep: when the STT timeout fires nothing is left polling in a thread.
+    """
+    async def _run():
+        t = await _in_pool(aai.Transcriber().submit, audio)
+        while t.status not in (aai.TranscriptStatus.completed, aai.TranscriptStatus.error):
+            await asyncio.sleep(STT_POLL_INTERVAL)
+            t = await _in_pool(aai.Transcript.get_by_id, t.id)
+        if t.status == aai.TranscriptStatus.error:
+            raise ProviderError(f"AssemblyAI error: {t.error}")
+        return (t.text or "").strip()
+    return await stt.call(_run)
+
+async def stt_upload(chunks) -> str:
+    """
+    Stream audio chunks (async iterator) to AssemblyAI's upload endpoint as they
+    arrive; returns the upload URL to pass to `transcribe`. Deliberately outside
+    the STT slot/timeout: the request stays open for as long as the user talks.
+    """
+    if not ASSEMBLYAI_API_KEY:
+        raise RuntimeError("ASSEMBLYAI_API_KEY not configured")
+    r = await http_client().post(ASSEMBLYAI_UPLOAD, content=chunks, headers={"authorization":ASSEMBLYAI_API_KEY})
+    if r.status_code != 200:
+        raise stt.error(f"AssemblyAI upload error {r.status_code}: {r.text}", retryable=r.status_code >= 500)
+    return r.json()["upload_url"]
+
+async def generate(prompt: str) -> str:
+    if not gemini_client:
+        raise RuntimeError("GEMINI_API_KEY not configured")
+    resp = await llm.call(gemini_client.aio.models.generate_content, model=GEMINI_MODEL, contents=prompt)
+    return (getattr(resp, "text", None) or "").strip()
+
+async def generate_stream(prompt: str):
+    """Yield Gemini reply text deltas as they arrive."""
+    if not gemini_client:
+        raise RuntimeError("GEMINI_API_KEY not configured")
+    async for chunk in llm.stream(gemini_client.aio.models.generate_content_stream, model=GEMINI_MODEL, contents=prompt):
+        text = getattr(chunk, "text", None)
+        if text:
+            yield text
+
+async def murf_generate(text: str, voice_id: str, fmt: str = "mp3") -> str:
+    """Synthesize one chunk (<= Murf's char limit) and return its audio URL."""
+    if not MURF_API_KEY:
+        raise RuntimeError("MURF_API_KEY not configured")
+    headers = {"accept":"application/json","content-type":"application/json","api-key":MURF_API_KEY}
+    r = await tts.call(http_client().post, MURF_API, json={"voiceId":voice_id,"text":text,"format":fmt}, headers=headers)
+    if r.status_code != 200:
+        raise tts.error(f"Murf error {r.status_code}: {r.text}", retryable=r.status_code == 429 or r.status_code >= 500)
+    url = r.json().get("audioFile")
+    if not url:
+        raise tts.error("Murf returned no audioFile")
+    return url
+
+async def download(url: str) -> bytes:
+    """Fetch rendered audio over the pooled client (used by the TTS cache)."""
+    r = await http_client().get(url)
+    r.raise_for_status()
+    return r.content
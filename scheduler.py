@@ -0,0 +1,116 @@
+# scheduler.py — admission control, per-session ordering and request coalescing
+#
+# Sits in front of the pipeline so overload degrades gracefully:
+#   * AdmissionControl: at most `max_active` turns talk to providers at once,
+#     at most `max_queued` wait behind them; anything beyond that is shed
+#     immediately (503 + Retry-After) instead of piling onto slow providers.
+#   * OpenLimit: caps resources held while users talk (streaming recordings and
+#     their uploads) separately, so speech time never occupies a turn slot.
+#   * SessionLocks: turns of one session run one at a time, in arrival order,
+#     so they append to history in order.
+#   * SingleFlight: identical in-flight work (e.g. the same TTS chunk, or many
+#     simultaneous fallback renders) runs once and every caller shares the result.
+import math
+import time
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from typing import Awaitable, Callable, Dict, List
+
+import metrics
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after: int = 1):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+class AdmissionControl:
+    def __init__(self, max_active: int, max_queued: int, queue_timeout: float):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        self.active = 0
+        self._sem = asyncio.Semaphore(max_active)
+        self._avg_turn = 2.0  # EWMA of slot hold time, seeds Retry-After
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self._avg_turn * (self.waiting + 1) / self.max_active))
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.active + self.waiting >= self.max_active + self.max_queued:
+            raise Overloaded("queue full", self.retry_after())
+        self.waiting += 1
+        metrics.TURNS_QUEUED.inc()
+        try:
+            await asyncio.wait_for(self._sem.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise Overloaded("queue timeout", self.retry_after()) from None
+        finally:
+            self.waiting -= 1
+            metrics.TURNS_QUEUED.dec()
+        self.active += 1
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._sem.release()
+            self._avg_turn = 0.8 * self._avg_turn + 0.2 * (time.monotonic() - t0)
+
+class OpenLimit:
+    """Non-queuing cap on long-lived resources (e.g. recordings being uploaded): a place or an immediate shed."""
+
+    def __init__(self, limit: int, what: str):
+        self.limit = limit
+        self.what = what
+        self.open = 0
+
+    @contextmanager
+    def hold(self):
+        if self.open >= self.limit:
+            raise Overloaded(f"too many open {self.what}")
+        self.open += 1
+        try:
+            yield
+        finally:
+            self.open -= 1
+
+class SessionLocks:
+    """FIFO lock per session; entries disappear when no turn holds or awaits them."""
+
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+        self._locks: Dict[str, List] = {}  # session_id -> [asyncio.Lock, holders + waiters]
+
+    @asynccontextmanager
+    async def hold(self, session_id: str):
+        entry = self._locks.get(session_id)
+        if entry is None:
+            entry = self._locks[session_id] = [asyncio.Lock(), 0]
+        elif entry[1] > self.max_pending:
+            raise Overloaded("too many turns queued for this session")
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[session_id]
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def pending(self, key: str) -> bool:
+        return key in self._inflight
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]):
+        """Run `fn()` once per key at a time; concurrent callers await the same result."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: one caller going away must not cancel the work for the others
+        return await asyncio.shield(task)
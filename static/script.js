@@ -1,6 +1,13 @@
 // Day 12 UI (with Day 10 history + Day 11 error handling)
 // Backend base URL
 const API = "http://127.0.0.1:8000";
+const WS_API = API.replace(/^http/, "ws");
+// Stream turns over /agent/stream (audio starts after the first sentence);
+// set to false to use the one-shot /agent/chat endpoint.
+const USE_STREAMING = true;
+// Streaming turns upload the recording in slices of this many ms while the
+// user is still talking, so the server can start STT as soon as they stop.
+const TIMESLICE_MS = 250;
 
 // DOM refs
 const chatEl = document.getElementById("chat");
@@ -18,6 +25,11 @@ function shortId(id){
   return `${id.slice(0,4)}…${id.slice(-4)}`;
 }
 
+// Cached audio is served by the backend as a relative /audio/... path
+function audioUrl(u){
+  return new URL(u, API).toString();
+}
+
 function getOrCreateSessionId(){
   const url = new URL(window.location.href);
   let sid = url.searchParams.get("session_id");
@@ -61,6 +73,7 @@ function addBubble(role, text){
   div.appendChild(txt);
   chatEl.appendChild(div);
   chatEl.scrollTop = chatEl.scrollHeight;
+  return txt;
 }
 
 function showError(msg){
@@ -92,6 +105,7 @@ fetchAndRenderHistory(SESSION_ID);
 let mediaRecorder = null;
 let chunks = [];
 let isRecording = false;
+let streamingTurn = false;
 
 recordBtn.addEventListener("click", async ()=>{
   if (!isRecording){
@@ -100,16 +114,23 @@ recordBtn.addEventListener("click", async ()=>{
       const stream = await navigator.mediaDevices.getUserMedia({ audio:true });
       mediaRecorder = new MediaRecorder(stream);
       chunks = [];
+      streamingTurn = USE_STREAMING && await beginStreamTurn();
 
       mediaRecorder.ondataavailable = (e)=>{
-        if (e.data.size > 0) chunks.push(e.data);
+        if (e.data.size === 0) return;
+        chunks.push(e.data);  // kept so a dropped socket can fall back to /agent/chat
+        if (streamingTurn && ws && ws.readyState === WebSocket.OPEN) ws.send(e.data);
       };
       mediaRecorder.onstop = async ()=>{
+        if (streamingTurn && ws && ws.readyState === WebSocket.OPEN){
+          ws.send(JSON.stringify({ type: "end" }));
+          return;
+        }
         const blob = new Blob(chunks, { type: "audio/webm" });
         await sendToAgent(blob);
       };
 
-      mediaRecorder.start();
+      mediaRecorder.start(streamingTurn ? TIMESLICE_MS : undefined);
       isRecording = true;
       recordBtn.classList.add("is-recording");
       statusText.textContent = "Listening… Tap to stop.";
@@ -185,7 +206,7 @@ function playSequential(urls, autoRecordAfter){
     audioEl.onended = async ()=>{
       i++;
       if (i < urls.length){
-        audioEl.src = urls[i];
+        audioEl.src = audioUrl(urls[i]);
         audioEl.play();
       }else{
         audioEl.onended = null;
@@ -197,8 +218,115 @@ function playSequential(urls, autoRecordAfter){
         resolve();
       }
     };
-    audioEl.src = urls[0];
+    audioEl.src = audioUrl(urls[0]);
     audioEl.play();
     statusText.textContent = "Playing response…";
   });
 }
+
+// ---------- Streaming turns (WebSocket) ----------
+let ws = null;
+let wsSid = null;
+let liveReply = null;   // AI bubble text element being filled by deltas
+let turnDone = false;   // server sent "done"/"error" for the current turn
+let autoRecordAfterTurn = false;
+
+// Playback queue: sentence audio is played in arrival order while later
+// sentences are still being synthesized.
+const playQueue = [];
+let playing = false;
+
+function enqueueAudio(url){
+  playQueue.push(url);
+  if (!playing) playNext();
+}
+
+function playNext(){
+  const url = playQueue.shift();
+  if (!url){
+    playing = false;
+    if (turnDone) onStreamPlaybackFinished();
+    return;
+  }
+  playing = true;
+  audioEl.onended = playNext;
+  audioEl.src = audioUrl(url);
+  audioEl.play().catch(err=>{ console.error(err); playNext(); });
+  statusText.textContent = "Playing response…";
+}
+
+function onStreamPlaybackFinished(){
+  audioEl.onended = null;
+  fetchAndRenderHistory(wsSid);
+  if (autoRecordAfterTurn){
+    statusText.textContent = "Your turn. Tap the mic to speak.";
+    setTimeout(()=>recordBtn.click(), 800);
+  }else{
+    statusText.textContent = "Tap the mic to try again.";
+  }
+}
+
+function openStream(sid){
+  if (ws && wsSid === sid && ws.readyState === WebSocket.OPEN) return Promise.resolve(ws);
+  if (ws){
+    // detach first: the old socket's late events must not touch its replacement
+    ws.onmessage = ws.onclose = ws.onerror = null;
+    ws.close();
+  }
+  wsSid = sid;
+  const sock = new WebSocket(`${WS_API}/agent/stream/${encodeURIComponent(sid)}`);
+  ws = sock;
+  sock.binaryType = "arraybuffer";
+  sock.onmessage = (e)=>handleStreamMessage(JSON.parse(e.data));
+  sock.onclose = ()=>{ if (ws === sock) ws = null; };
+  return new Promise((resolve, reject)=>{
+    sock.onopen = ()=>resolve(sock);
+    sock.onerror = reject;
+  });
+}
+
+function handleStreamMessage(msg){
+  switch (msg.type){
+    case "transcript":
+      addBubble("user", msg.text);
+      liveReply = null;
+      statusText.textContent = "Thinking…";
+      break;
+    case "delta":
+      if (!liveReply) liveReply = addBubble("ai", "");
+      liveReply.textContent += msg.text;
+      chatEl.scrollTop = chatEl.scrollHeight;
+      break;
+    case "audio":
+      enqueueAudio(msg.url);
+      break;
+    case "done":
+      turnDone = true;
+      autoRecordAfterTurn = true;
+      if (!playing) onStreamPlaybackFinished();
+      break;
+    case "error":
+      // shed by the server mid-recording: stop now (onstop still sends "end")
+      if (msg.retry_after && isRecording) recordBtn.click();
+      turnDone = true;
+      autoRecordAfterTurn = false;
+      showError(msg.error || "Failed to process your request.");
+      playQueue.length = 0;
+      (msg.audio_urls || []).forEach(enqueueAudio);
+      if (!playing) onStreamPlaybackFinished();
+      break;
+  }
+}
+
+// Open (or reuse) the socket before recording starts so chunks can flow immediately
+async function beginStreamTurn(){
+  const sid = sessionIdInput.value.trim() || SESSION_ID;
+  try{
+    await openStream(sid);
+    turnDone = false;
+    return true;
+  }catch(e){
+    console.error("Streaming unavailable, falling back to /agent/chat", e);
+    return false;
+  }
+}
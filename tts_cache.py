@@ -0,0 +1,139 @@
+# tts_cache.py — content-addressed TTS cache (in-memory LRU + on-disk audio store)
+#
+# Keys are a hash of (normalized text, voice, format), so the same sentence in
+# the same voice is only ever synthesized once. Hot entries map to an audio URL
+# in an LRU with TTL (Murf's signed URLs expire); rendered audio can also be
+# downloaded into `directory` and served locally, which is how canned phrases
+# such as the error fallback survive restarts and provider outages.
+import os
+import time
+import asyncio
+import hashlib
+import traceback
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import providers
+
+def normalize(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+def cache_key(text: str, voice_id: str, fmt: str) -> str:
+    raw = f"{voice_id}\x00{fmt}\x00{normalize(text)}".encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+class TTSCache:
+    def __init__(self, directory: Path, url_prefix: str = "/audio", max_entries: int = 2048,
+                 ttl: float = 3600, persist: bool = True, max_files: int = 1000):
+        self.directory = directory
+        self.url_prefix = url_prefix.rstrip("/")
+        # with persist every entry ends up as a local file: never remember more than the disk keeps
+        self.max_entries = min(max_entries, max_files) if persist else max_entries
+        self.ttl = ttl
+        self.persist = persist
+        self.max_files = max_files
+        self.pinned = set()  # keys that pruning must never delete (canned phrases)
+        self._mem: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._writes = set()
+        directory.mkdir(parents=True, exist_ok=True)
+
+    # ---------- Lookup ----------
+    def _file(self, key: str, fmt: str) -> Path:
+        return self.directory / f"{key}.{fmt}"
+
+    def _local_url(self, key: str, fmt: str) -> str:
+        return f"{self.url_prefix}/{key}.{fmt}"
+
+    def _remember(self, key: str, url: str):
+        self._mem[key] = (time.monotonic() + self.ttl, url)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def get(self, text: str, voice_id: str, fmt: str = "mp3") -> Optional[str]:
+        key = cache_key(text, voice_id, fmt)
+        hit = self._mem.get(key)
+        if hit:
+            expires, url = hit
+            # local files can be pruned underneath us (also by other workers sharing the directory)
+            if expires > time.monotonic() and (url.startswith("http") or self._file(key, fmt).exists()):
+                self._mem.move_to_end(key)
+                return url
+            del self._mem[key]
+        if self._file(key, fmt).exists():
+            url = self._local_url(key, fmt)
+            self._remember(key, url)
+            return url
+        return None
+
+    def put(self, text: str, voice_id: str, url: str, fmt: str = "mp3"):
+        """Remember a freshly rendered URL; with `persist`, copy the audio to disk in the background."""
+        key = cache_key(text, voice_id, fmt)
+        self._remember(key, url)
+        if self.persist and url.startswith("http"):
+            task = asyncio.create_task(self._store_quietly(key, fmt, url))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+    # ---------- Disk store ----------
+    async def store(self, key: str, fmt: str, url: str) -> str:
+        """Download `url` into the disk store and return the local URL that now serves it."""
+        data = await providers.download(url)
+        pruned = await asyncio.to_thread(self._write, key, fmt, data)
+        for gone in pruned:
+            self._mem.pop(gone, None)
+        local = self._local_url(key, fmt)
+        self._remember(key, local)
+        return local
+
+    async def _store_quietly(self, key: str, fmt: str, url: str):
+        try:
+            await self.store(key, fmt, url)
+        except Exception:
+            print("TTS cache write failed:\n", traceback.format_exc())
+
+    def _write(self, key: str, fmt: str, data: bytes) -> List[str]:
+        path = self._file(key, fmt)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        return self._prune()
+
+    def _prune(self) -> List[str]:
+        """Delete the oldest unpinned files beyond `max_files`; returns their keys."""
+        files = [e for e in os.scandir(self.directory) if e.is_file() and not e.name.endswith(".tmp")]
+        excess = len(files) - self.max_files
+        pruned = []
+        if excess <= 0:
+            return pruned
+        files.sort(key=lambda e: e.stat().st_mtime)
+        for e in files:
+            if excess <= 0:
+                break
+            key = e.name.split(".", 1)[0]
+            if key in self.pinned:
+                continue
+            Path(e.path).unlink(missing_ok=True)
+            pruned.append(key)
+            excess -= 1
+        return pruned
+
+    # ---------- Canned phrases ----------
+    async def prerender(self, phrases: Iterable[str], voice_id: str, fmt: str = "mp3"):
+        """Make sure every canned phrase is rendered and stored locally (runs at startup)."""
+        for text in phrases:
+            key = cache_key(text, voice_id, fmt)
+            self.pinned.add(key)
+            if self.get(text, voice_id, fmt):
+                continue
+            try:
+                url = await providers.murf_generate(normalize(text), voice_id, fmt)
+                await self.store(key, fmt, url)
+            except Exception:
+                print(f"Pre-render failed for {text!r}:\n", traceback.format_exc())
+
+    async def aclose(self):
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)